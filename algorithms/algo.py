@@ -4,6 +4,10 @@ import os
 import random
 import shutil
 import pandas as pd
+import manifest
+import label_store
+import features
+import virtual_audio
 
 def k_fold(dataset_path, output_path, fold):
     # Paths to input files and directories
@@ -12,7 +16,9 @@ def k_fold(dataset_path, output_path, fold):
     audio_path = os.path.join(dataset_path, 'audio')
     
     # Load audio chunks and labels
-    audio_chunks = os.listdir(audio_path)  # List of audio filenames
+    chunk_manifest = manifest.load_manifest(manifest.manifest_path(dataset_path))
+    virtual_chunks = {chunk for chunk, entry in chunk_manifest.items() if virtual_audio.is_virtual(entry)}
+    audio_chunks = list(set(os.listdir(audio_path)) | virtual_chunks)  # List of audio filenames
     audio_chunks.sort()  # Ensure consistent ordering
     num_chunks = len(audio_chunks)
     
@@ -38,14 +44,20 @@ def k_fold(dataset_path, output_path, fold):
     test_labels = {}
     train_labels = {}
     
+    reader = virtual_audio.VirtualChunkReader(dataset_path) if virtual_chunks else None
     for i, chunk in enumerate(audio_chunks):
         chunk_path = os.path.join(audio_path, chunk)
+        split_audio = test_audio if i in test_indices else train_audio
         if i in test_indices:
             test_labels[chunk] = label_json.get(chunk, {})
-            shutil.copy(chunk_path, test_audio)
         else:
             train_labels[chunk] = label_json.get(chunk, {})
-            shutil.copy(chunk_path, train_audio)
+        if chunk in virtual_chunks:
+            reader.materialize(chunk, os.path.join(split_audio, chunk))  # Splits get real files
+        else:
+            shutil.copy2(chunk_path, split_audio)  # Keeps mtime, so cached features stay valid
+    if reader is not None:
+        reader.close()
     
     # Save test labels to JSON
     with open(os.path.join(test_dataset, 'test_labels.json'), 'w') as f:
@@ -54,6 +66,24 @@ def k_fold(dataset_path, output_path, fold):
     # Save train labels to JSON
     with open(os.path.join(train_dataset, 'train_labels.json'), 'w') as f:
         json.dump(train_labels, f, indent=4)
+
+    # Save split manifests so loaders get durations without reopening the audio
+    chunk_manifest = {chunk: {**entry, "virtual": False} if chunk in virtual_chunks else entry
+                      for chunk, entry in chunk_manifest.items()}
+    if chunk_manifest:
+        manifest.save_manifest(manifest.manifest_path(test_dataset, 'test'),
+                               manifest.sync_with_labels(chunk_manifest, test_labels))
+        manifest.save_manifest(manifest.manifest_path(train_dataset, 'train'),
+                               manifest.sync_with_labels(chunk_manifest, train_labels))
+
+    # Split the Parquet label store with the chunk filter pushed into the scan
+    if label_store.exists(dataset_path):
+        label_store.split_store(dataset_path, test_dataset, test_labels, 'test')
+        label_store.split_store(dataset_path, train_dataset, train_labels, 'train')
+
+    # Split feature indexes point into the parent dataset's feature cache
+    features.split_features(dataset_path, test_dataset, test_labels, 'test')
+    features.split_features(dataset_path, train_dataset, train_labels, 'train')
     
     # Process CSV and save filtered data
     with open(label_csv_path, 'r') as csvfile:
@@ -88,9 +118,10 @@ def k_fold(dataset_path, output_path, fold):
 def rename_and_update_labels(dataset_folder, label):
     """
     Renames all audio files in the dataset folder to continuous numbering,
-    updates the labels.json file accordingly, and regenerates the labels.csv file.
+    updates the labels.json and manifest.json files accordingly, and regenerates the labels.csv file.
     """
     labels_file = os.path.join(dataset_folder, f"{label}_labels.json")
+    manifest_file = manifest.manifest_path(dataset_folder, label)
     audio_folder = os.path.join(dataset_folder, "audio")
     labels_csv_path = os.path.join(dataset_folder, f"{label}_labels.csv")
 
@@ -108,18 +139,20 @@ def rename_and_update_labels(dataset_folder, label):
 
     # Get all audio files and sort them numerically
     chunks = sorted(
-        [f for f in os.listdir(audio_folder) if f.endswith(".ogg")],
+        [f for f in os.listdir(audio_folder) if f.endswith(".wav")],
         key=lambda x: int(x.split(".")[0]) if x.split(".")[0].isdigit() else float('inf')
     )
 
     new_labels = {}
+    renamed = {}
     for index, chunk in enumerate(chunks, start=1):
         old_path = os.path.join(audio_folder, chunk)
-        new_name = f"{index}.ogg"
+        new_name = f"{index}.wav"
         new_path = os.path.join(audio_folder, new_name)
 
         # Rename the audio file
         os.rename(old_path, new_path)
+        renamed[chunk] = new_name
 
         # Update the labels with the new name
         if chunk in labels:
@@ -129,20 +162,19 @@ def rename_and_update_labels(dataset_folder, label):
     with open(labels_file, "w") as f:
         json.dump(new_labels, f, indent=4)
 
+    # Apply the same renaming to the split manifest
+    if os.path.exists(manifest_file):
+        chunk_manifest = manifest.rename_entries(manifest.load_manifest(manifest_file), renamed)
+        manifest.save_manifest(manifest_file, manifest.sync_with_labels(chunk_manifest, new_labels))
+    if label_store.exists(dataset_folder, label):
+        label_store.rename_chunks(dataset_folder, renamed, label, new_labels)
+    if renamed:
+        features.rename_features(dataset_folder, renamed, label)
+
     # Regenerate the labels.csv file
     print("Updating labels.csv file...")
-    data = []
-    for chunk, words in new_labels.items():
-        for word_info in words:
-            data.append({
-                "Chunk": chunk,
-                "Word": word_info["word"],
-                "Start Time": word_info["start"],
-                "End Time": word_info["end"]
-            })
-
-    # Write the updated labels.csv
-    df = pd.DataFrame(data, columns=["Chunk", "Word", "Start Time", "End Time"])
+    df = pd.DataFrame({"Chunk": list(new_labels.keys()), "Transcription": list(new_labels.values())},
+                      columns=["Chunk", "Transcription"])
     df.to_csv(labels_csv_path, index=False)
     print("✅ Audio files renamed, labels.json and labels.csv updated successfully!")
  
\ No newline at end of file
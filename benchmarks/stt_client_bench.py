@@ -0,0 +1,125 @@
+"""
+Compares per-request latency of the pooled STT client against the old
+recognize_google-style path (fresh connection + `flac` subprocess per chunk).
+
+Both run against a local HTTPS stand-in for the Google endpoint, so only
+connection setup and encoding are measured, not Google's recognition time.
+
+Usage:
+    python benchmarks/stt_client_bench.py path/to/chunk.wav [--requests 200]
+"""
+import argparse
+import os
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import speech_recognition as sr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stt_client  # noqa: E402
+
+
+FAKE_RESPONSE = (
+    b'{"result":[]}\n'
+    b'{"result":[{"alternative":[{"transcript":"hello world","confidence":0.9}],"final":true}],"result_index":0}\n'
+)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real endpoint
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(FAKE_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(FAKE_RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_self_signed_cert(folder):
+    certfile = os.path.join(folder, "cert.pem")
+    keyfile = os.path.join(folder, "key.pem")
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost", "-keyout", keyfile, "-out", certfile,
+    ], check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def start_stand_in(certfile, keyfile):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"https://localhost:{server.server_address[1]}/speech-api/v2/recognize"
+
+
+def bench_baseline(wav_path, url, certfile, count):
+    """One new connection and one `flac` process per request, as recognize_google does."""
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        recognizer = sr.Recognizer()
+        with sr.AudioFile(wav_path) as source:
+            audio = recognizer.record(source)
+        flac_data = audio.get_flac_data(convert_width=2)
+        with requests.Session() as session:
+            response = session.post(url, data=flac_data, verify=certfile,
+                                    headers={"Content-Type": f"audio/x-flac; rate={audio.sample_rate}"})
+            stt_client.GoogleSTTClient._best_transcript(response.content.decode("utf-8"))
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_pooled(wav_path, url, certfile, count):
+    timings = []
+    with stt_client.GoogleSTTClient(url=url, verify=certfile) as client:
+        for _ in range(count):
+            start = time.perf_counter()
+            client.recognize_file(wav_path)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    ordered = sorted(timings)
+    p95 = ordered[int(len(ordered) * 0.95) - 1] if len(ordered) >= 20 else ordered[-1]
+    print(f"{name:<10} mean {statistics.mean(timings) * 1000:7.2f} ms | "
+          f"p50 {statistics.median(timings) * 1000:7.2f} ms | p95 {p95 * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("wav", help="A chunk produced by run.py (e.g. Common_dataset/audio/1.wav)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--certfile", help="TLS certificate (a self-signed one is generated if omitted)")
+    parser.add_argument("--keyfile", help="TLS private key")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        certfile, keyfile = args.certfile, args.keyfile
+        if not certfile:
+            certfile, keyfile = make_self_signed_cert(tmp)
+        server, url = start_stand_in(certfile, keyfile)
+        try:
+            report("baseline", bench_baseline(args.wav, url, certfile, args.requests))
+            report("pooled", bench_pooled(args.wav, url, certfile, args.requests))
+        finally:
+            server.shutdown()
@@ -1,6 +1,13 @@
 import os
+import re
 import json
+import wave
+import shutil
 import pandas as pd
+import manifest
+import label_store
+import features
+import virtual_audio
 
 
 def load_labels(label_path):
@@ -12,14 +19,17 @@ def load_labels(label_path):
 
 
 def save_labels(label_path, labels):
-    """Save updated labels to label.json"""
-    with open(label_path, "w", encoding="utf-8") as file:
+    """Save updated labels to label.json (atomically, a crash never leaves a half-written file)"""
+    temp_path = f"{label_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
         json.dump(labels, file, indent=4, ensure_ascii=False)
+    os.replace(temp_path, label_path)
 
 
-def update_labels_csv(dataset_path, labels):
-    """Update labels.csv based on the updated labels.json"""
-    labels_csv_path = os.path.join(dataset_path, "labels.csv")
+def update_labels_csv(dataset_path, labels, labels_csv_path=None):
+    """Update labels.csv (or `labels_csv_path`) based on the updated labels.json, atomically like labels.json"""
+    labels_csv_path = labels_csv_path or os.path.join(dataset_path, "labels.csv")
+    temp_path = f"{labels_csv_path}.tmp"
     data = []
 
     for chunk, text in labels.items():
@@ -29,11 +39,48 @@ def update_labels_csv(dataset_path, labels):
         })
 
     # Write the updated labels.csv
-    df = pd.DataFrame(data)
-    df.to_csv(labels_csv_path, index=False)
+    df = pd.DataFrame(data, columns=["Chunk", "Transcription"])
+    df.to_csv(temp_path, index=False)
+    os.replace(temp_path, labels_csv_path)
     print(" labels.csv file created successfully!")
 
 
+def update_manifest(dataset_path, labels):
+    """Drop manifest.json entries of chunks that no longer have a label"""
+    manifest_file = manifest.manifest_path(dataset_path)
+    if os.path.exists(manifest_file):
+        chunk_manifest = manifest.load_manifest(manifest_file)
+        manifest.save_manifest(manifest_file, manifest.sync_with_labels(chunk_manifest, labels))
+
+
+def update_label_store(dataset_path, labels):
+    """Rewrite labels.parquet (compacted) without the removed chunks"""
+    if label_store.exists(dataset_path):
+        chunk_manifest = manifest.load_manifest(manifest.manifest_path(dataset_path))
+        label_store.write_labels(dataset_path, labels, chunk_manifest)
+
+
+def update_feature_cache(dataset_path, labels):
+    """Forget cached features of removed chunks and reclaim their rows"""
+    features.drop_features(dataset_path, labels)
+    features.compact_feature_cache(dataset_path)
+
+
+def update_sources(dataset_path):
+    """Delete sources/<id>.wav files that no virtual chunk in manifest.json points into anymore"""
+    folder = virtual_audio.sources_folder(dataset_path)
+    if not os.path.exists(folder):
+        return 0
+    chunk_manifest = manifest.load_manifest(manifest.manifest_path(dataset_path))
+    in_use = {str(entry["source_id"]) for entry in chunk_manifest.values() if virtual_audio.is_virtual(entry)}
+    orphans = [f for f in os.listdir(folder) if f.endswith(".wav") and f[:-4] not in in_use]
+    for source in orphans:
+        os.remove(os.path.join(folder, source))
+    if orphans:
+        print(f"🗑️ Removed {len(orphans)} source files no chunk points into anymore.")
+    return len(orphans)
+
+
 def auto_clean_dataset(dataset_path):
     """
     Automatically remove duplicate chunks and labels from the dataset.
@@ -88,8 +135,11 @@ def auto_clean_dataset(dataset_path):
     # Save updated labels
     save_labels(labels_file, labels)
 
-    # Update labels.csv
+    # Update labels.csv, manifest.json, labels.parquet and the feature index
     update_labels_csv(dataset_path, labels)
+    update_manifest(dataset_path, labels)
+    update_label_store(dataset_path, labels)
+    update_feature_cache(dataset_path, labels)
 
     print(f"\n✅ Auto-clean complete! {removed_files} duplicate files removed.")
 
@@ -104,9 +154,11 @@ def clean_dataset(dataset_path):
     # Load labels
     labels = load_labels(labels_file)
 
-    # List all audio chunks
+    # List all audio chunks, including virtual ones that only exist in manifest.json
+    chunk_manifest = manifest.load_manifest(manifest.manifest_path(dataset_path))
+    virtual_chunks = {chunk for chunk, entry in chunk_manifest.items() if virtual_audio.is_virtual(entry)}
     audio_chunks = sorted(
-        (f for f in os.listdir(audio_folder) if f.endswith(".wav")),
+        {f for f in os.listdir(audio_folder) if f.endswith(".wav")} | virtual_chunks,
         key=lambda x: int(x.split(".")[0]) if x.split(".")[0].isdigit() else float('inf')
     )
 
@@ -136,11 +188,14 @@ def clean_dataset(dataset_path):
         chunk = f"{chunk_num}.wav"
         chunk_path = os.path.join(audio_folder, chunk)
 
-        # Remove file
+        # Remove file (virtual chunks have none, dropping their label is enough)
         if os.path.exists(chunk_path):
             os.remove(chunk_path)
             removed_files += 1
             print(f"✅ Removed: {chunk}")
+        elif chunk in virtual_chunks:
+            removed_files += 1
+            print(f"✅ Removed virtual chunk: {chunk}")
 
         # Remove label entry
         if chunk in labels:
@@ -154,23 +209,263 @@ def clean_dataset(dataset_path):
     # Save updated labels
     save_labels(labels_file, labels)
 
-    # Update labels.csv
+    # Update labels.csv, manifest.json, labels.parquet and the feature index
     update_labels_csv(dataset_path, labels)
+    update_manifest(dataset_path, labels)
+    update_label_store(dataset_path, labels)
+    update_feature_cache(dataset_path, labels)
+    update_sources(dataset_path)
 
     print(f"\n✅ Clean complete! {removed_files} files removed.")
 
 
+def wav_duration(wav_path):
+    """Read a chunk's duration from its WAV header, None if the file is missing"""
+    try:
+        with wave.open(wav_path, "rb") as wav:
+            return wav.getnframes() / wav.getframerate()
+    except FileNotFoundError:
+        return None
+
+
+def load_label_table(dataset_path):
+    """
+    Build a table of every labelled chunk with its number, transcription,
+    duration (from manifest.json, or the WAV header for older datasets) and
+    character rate, so filters run over whole columns at once.
+    """
+    labels = load_labels(os.path.join(dataset_path, "labels.json"))
+    chunk_manifest = manifest.load_manifest(manifest.manifest_path(dataset_path))
+
+    table = pd.DataFrame({"Chunk": pd.Series(list(labels.keys()), dtype=str),
+                          "Transcription": pd.Series(list(labels.values()), dtype=str)})
+    table["ChunkNum"] = pd.to_numeric(table["Chunk"].str.replace(".wav", "", regex=False), errors="coerce")
+    table["Duration"] = table["Chunk"].map(
+        {chunk: entry["duration"] for chunk, entry in chunk_manifest.items()}).astype(float)
+
+    missing = table["Duration"].isna()
+    if missing.any():
+        audio_folder = os.path.join(dataset_path, "audio")
+        table.loc[missing, "Duration"] = [wav_duration(os.path.join(audio_folder, chunk))
+                                          for chunk in table.loc[missing, "Chunk"]]
+
+    table["CharRate"] = table["Transcription"].str.len() / table["Duration"]
+    return table.sort_values("ChunkNum", ignore_index=True)
+
+
+def parse_chunk_ranges(text):
+    """
+    Parse "1-100, 250, 300-310" into [(1, 100), (250, 250), (300, 310)].
+
+    Raises:
+        ValueError: If a part is not a chunk number or a start-end range.
+    """
+    ranges = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = (value.strip() for value in part.partition("-"))
+        end = end or start
+        if not (start.isdigit() and end.isdigit()) or int(start) > int(end):
+            raise ValueError(f"Invalid chunk range: {part}")
+        ranges.append((int(start), int(end)))
+    return ranges
+
+
+def select_chunks(table, pattern=None, min_duration=None, max_duration=None,
+                  min_char_rate=None, max_char_rate=None, chunk_ranges=None):
+    """
+    Select the chunks matching every given filter (filters left as None are ignored).
+
+    Args:
+        table (DataFrame): Label table from `load_label_table`.
+        pattern (str): Regex searched in the transcription.
+        min_duration, max_duration (float): Duration range in seconds.
+        min_char_rate, max_char_rate (float): Characters per second range.
+        chunk_ranges (list): Inclusive (start, end) chunk number ranges.
+
+    Returns:
+        DataFrame: The selected rows.
+    """
+    mask = pd.Series(True, index=table.index)
+    if pattern:
+        mask &= table["Transcription"].str.contains(pattern, regex=True, na=False)
+    if min_duration is not None:
+        mask &= table["Duration"] >= min_duration
+    if max_duration is not None:
+        mask &= table["Duration"] <= max_duration
+    if min_char_rate is not None:
+        mask &= table["CharRate"] >= min_char_rate
+    if max_char_rate is not None:
+        mask &= table["CharRate"] <= max_char_rate
+    if chunk_ranges:
+        in_ranges = pd.Series(False, index=table.index)
+        for start, end in chunk_ranges:
+            in_ranges |= table["ChunkNum"].between(start, end)
+        mask &= in_ranges
+    return table[mask]
+
+
+def preview_selection(selection, limit=10):
+    """Dry run: summarize what a bulk clean would remove without touching anything"""
+    print(f"\n{len(selection)} chunks selected ({selection['Duration'].sum():.1f}s of audio).")
+    if len(selection):
+        print(selection[["Chunk", "Duration", "CharRate", "Transcription"]].head(limit).to_string(index=False))
+        if len(selection) > limit:
+            print(f"... and {len(selection) - limit} more")
+
+
+CLEAN_COMMIT = "clean_commit.json"
+
+
+def staged_files(dataset_path):
+    """(staged path, live path) of every label file a bulk clean rewrites"""
+    live = [
+        os.path.join(dataset_path, "labels.json"),
+        os.path.join(dataset_path, "labels.csv"),
+        manifest.manifest_path(dataset_path),
+        label_store.store_path(dataset_path),
+        features.index_path(dataset_path),
+    ]
+    return [(f"{path}.new", path) for path in live]
+
+
+def bulk_remove(dataset_path, chunks):
+    """
+    Remove many chunks as a single commit. The new labels.json, labels.csv,
+    manifest.json, labels.parquet and feature index are first written next to
+    the live ones (`*.new`). Writing `clean_commit.json` then commits them all
+    at once: only after that are they swapped in and the audio deleted.
+    An interrupted clean is completed (or, if it never committed, discarded)
+    by `finish_bulk_remove`.
+    """
+    finish_bulk_remove(dataset_path)
+    to_remove = set(chunks)
+    (labels_new, labels_file), (csv_new, _), (manifest_new, manifest_file), _, (index_new, index_file) = \
+        staged_files(dataset_path)
+
+    labels = {chunk: text for chunk, text in load_labels(labels_file).items() if chunk not in to_remove}
+    save_labels(labels_new, labels)
+    update_labels_csv(dataset_path, labels, csv_new)
+    chunk_manifest = manifest.sync_with_labels(manifest.load_manifest(manifest_file), labels)
+    if os.path.exists(manifest_file):
+        manifest.save_manifest(manifest_new, chunk_manifest)
+    if label_store.exists(dataset_path):
+        label_store.stage_table(dataset_path, label_store.table_from_labels(labels, chunk_manifest))
+    if os.path.exists(index_file):
+        index = features.load_index(index_file)
+        index["chunks"] = {chunk: entry for chunk, entry in index["chunks"].items() if chunk in labels}
+        features.save_index(index_new, index)
+
+    # The commit point: from here on the clean is finished even if interrupted
+    commit_file = os.path.join(dataset_path, CLEAN_COMMIT)
+    with open(f"{commit_file}.tmp", "w", encoding="utf-8") as file:
+        json.dump({"remove": sorted(to_remove)}, file, indent=4, ensure_ascii=False)
+    os.replace(f"{commit_file}.tmp", commit_file)
+    return finish_bulk_remove(dataset_path)
+
+
+def finish_bulk_remove(dataset_path):
+    """
+    Applies a committed bulk clean: swaps the staged label files in, deletes
+    the audio and removes the commit marker. Staged files of a clean that was
+    interrupted before its commit are discarded, the live files are untouched.
+
+    Returns:
+        int: Number of audio files removed.
+    """
+    commit_file = os.path.join(dataset_path, CLEAN_COMMIT)
+    if not os.path.exists(commit_file):
+        leftovers = [f"{commit_file}.tmp"]
+        for staged, _ in staged_files(dataset_path):
+            leftovers += [staged, f"{staged}.tmp"]
+        for path in leftovers:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        return 0
+
+    with open(commit_file, "r", encoding="utf-8") as file:
+        to_remove = json.load(file)["remove"]
+    for staged, live in staged_files(dataset_path):
+        if os.path.isdir(staged):
+            label_store.swap_in(staged, live)
+        elif os.path.exists(staged):
+            os.replace(staged, live)
+    features.compact_feature_cache(dataset_path)
+
+    audio_folder = os.path.join(dataset_path, "audio")
+    removed_files = 0
+    for chunk in to_remove:
+        try:
+            os.remove(os.path.join(audio_folder, chunk))
+            removed_files += 1
+        except FileNotFoundError:
+            pass
+    update_sources(dataset_path)
+    os.remove(commit_file)
+
+    print(f"\n✅ Bulk clean complete! {removed_files} files and {len(to_remove)} label entries removed.")
+    return removed_files
+
+
+def bulk_clean_dataset(dataset_path):
+    """Ask for filters, preview the matching chunks and remove them on confirmation"""
+
+    def optional_float(prompt):
+        value = input(prompt).strip()
+        return float(value) if value else None
+
+    print("\nLeave any filter empty to skip it. Chunks must match every filter given.")
+    try:
+        pattern = input("Transcription regex: ").strip() or None
+        if pattern:
+            re.compile(pattern)
+        min_duration = optional_float("Minimum duration (s): ")
+        max_duration = optional_float("Maximum duration (s): ")
+        min_char_rate = optional_float("Minimum characters per second: ")
+        max_char_rate = optional_float("Maximum characters per second: ")
+        chunk_ranges = parse_chunk_ranges(input("Chunk ranges (e.g. 1-100,250): ").strip())
+    except re.error as error:
+        print(f"❌ Error: Invalid regex: {error}")
+        return
+    except ValueError as error:
+        print(f"❌ Error: {error}")
+        return
+
+    filters = (pattern, min_duration, max_duration, min_char_rate, max_char_rate)
+    if all(value is None for value in filters) and not chunk_ranges:
+        print("No filters given, nothing selected.")
+        return
+
+    selection = select_chunks(load_label_table(dataset_path), pattern, min_duration, max_duration,
+                              min_char_rate, max_char_rate, chunk_ranges)
+    preview_selection(selection)
+    if selection.empty:
+        return
+
+    if input("\nRemove these chunks? (y for yes /n for no): ").strip().lower() == "y":
+        bulk_remove(dataset_path, selection["Chunk"])
+    else:
+        print("Dry run only, nothing was removed.")
+
+
 # Example usage
 if __name__ == "__main__":
     dataset_path = input("Enter dataset path: ").strip()
     if not os.path.exists(dataset_path):
         print("Error: Dataset path not found.")
         exit(1)
+    finish_bulk_remove(dataset_path)  # Completes a bulk clean that was interrupted
 
-    mode = input("Choose mode (1: Manual clean, 2: Auto clean): ").strip()
+    mode = input("Choose mode (1: Manual clean, 2: Auto clean, 3: Bulk clean by filters): ").strip()
     if mode == "1":
         clean_dataset(dataset_path)
     elif mode == "2":
         auto_clean_dataset(dataset_path)
+    elif mode == "3":
+        bulk_clean_dataset(dataset_path)
     else:
         print("Invalid mode selected.")
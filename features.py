@@ -0,0 +1,393 @@
+import os
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from tqdm import tqdm
+
+import manifest
+import virtual_audio
+from stt_client import read_wav_pcm, pcm_to_int16
+
+
+DEFAULT_CONFIG = {
+    "kind": "logmel",      # "logmel" or "mfcc"
+    "n_fft": 400,          # 25 ms windows at 16 kHz
+    "hop_length": 160,     # 10 ms hop at 16 kHz
+    "n_mels": 80,
+    "n_mfcc": 13,
+}
+
+
+def cache_folder(dataset_folder):
+    return os.path.join(dataset_folder, "features")
+
+
+def index_path(dataset_folder, label=None):
+    """
+    Returns the feature index of a dataset folder. Split folders written by
+    `algo.k_fold` get a `{label}_features.json` index next to their own
+    `{label}_features.f32`. The index's "data" file is relative to its folder.
+    """
+    if label:
+        return os.path.join(dataset_folder, f"{label}_features.json")
+    return os.path.join(cache_folder(dataset_folder), "index.json")
+
+
+def load_index(path):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    return {"data": None, "config": None, "rows": 0, "chunks": {}}
+
+
+def save_index(path, index):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(index, file, indent=4)
+    os.replace(temp_path, path)
+
+
+@lru_cache(maxsize=8)
+def mel_filterbank(sample_rate, n_fft, n_mels):
+    """Triangular mel filters, shape (n_mels, n_fft // 2 + 1)"""
+    def hz_to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700)
+
+    def mel_to_hz(mel):
+        return 700 * (10 ** (mel / 2595) - 1)
+
+    bins = np.fft.rfftfreq(n_fft, 1 / sample_rate)
+    edges = mel_to_hz(np.linspace(hz_to_mel(0), hz_to_mel(sample_rate / 2), n_mels + 2))
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (bins - lower) / (center - lower)
+    falling = (upper - bins) / (upper - center)
+    return np.maximum(0, np.minimum(rising, falling)).astype(np.float32)
+
+
+@lru_cache(maxsize=4)
+def dct_matrix(n_mfcc, n_mels):
+    """Orthonormal DCT-II matrix turning log-mel frames into MFCCs"""
+    n = np.arange(n_mels)
+    basis = np.cos(np.pi / n_mels * (n + 0.5)[None, :] * np.arange(n_mfcc)[:, None])
+    basis[0] *= 1 / np.sqrt(2)
+    return (basis * np.sqrt(2 / n_mels)).astype(np.float32)
+
+
+def compute_features(samples, sample_rate, config=DEFAULT_CONFIG):
+    """
+    Log-mel (or MFCC) features of one chunk, computed with a vectorized STFT.
+
+    Args:
+        samples (ndarray): int16 mono samples.
+        sample_rate (int): Sample rate of the samples.
+        config (dict): See `DEFAULT_CONFIG`.
+
+    Returns:
+        ndarray: float32 array of shape (frames, n_mels or n_mfcc).
+    """
+    n_fft, hop_length = config["n_fft"], config["hop_length"]
+    audio = samples.astype(np.float32) / 32768
+    if len(audio) < n_fft:
+        audio = np.pad(audio, (0, n_fft - len(audio)))
+
+    frames = np.lib.stride_tricks.sliding_window_view(audio, n_fft)[::hop_length]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(n_fft).astype(np.float32), axis=1)) ** 2
+    log_mel = np.log(spectrum @ mel_filterbank(sample_rate, n_fft, config["n_mels"]).T + 1e-10)
+
+    if config["kind"] == "mfcc":
+        return (log_mel @ dct_matrix(config["n_mfcc"], config["n_mels"]).T).astype(np.float32)
+    return log_mel.astype(np.float32)
+
+
+def feature_width(config):
+    return config["n_mfcc"] if config["kind"] == "mfcc" else config["n_mels"]
+
+
+def _compute_batch(jobs, config):
+    """Process pool worker: features of a batch of chunk files or virtual (source, offset, samples) ranges"""
+    results = []
+    for job in jobs:
+        if isinstance(job, str):
+            pcm, sample_rate, sample_width, channels = read_wav_pcm(job)
+            samples = pcm_to_int16(pcm, sample_width, channels)
+        else:
+            samples, sample_rate = virtual_audio.read_source_range(*job)
+        results.append(compute_features(samples, sample_rate, config))
+    return results
+
+
+def file_signature(path):
+    """Size and modification time, used to notice a chunk changed since it was cached"""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def chunk_signature(dataset_folder, chunk, entry=None):
+    """
+    Signature of a chunk's audio: its file's, or for a virtual chunk its range
+    plus the signature of the source it points into.
+    """
+    if virtual_audio.is_virtual(entry):
+        return {**file_signature(virtual_audio.source_path(dataset_folder, entry["source_id"])),
+                "source_id": entry["source_id"], "byte_offset": entry["byte_offset"],
+                "num_samples": entry["num_samples"]}
+    return file_signature(os.path.join(dataset_folder, "audio", chunk))
+
+
+def signature_matches(cached, signature):
+    return all(cached.get(key) == value for key, value in signature.items())
+
+
+def _job(dataset_folder, chunk, entry):
+    if virtual_audio.is_virtual(entry):
+        source_file = virtual_audio.source_path(dataset_folder, entry["source_id"])
+        return source_file, entry["byte_offset"], entry["num_samples"]
+    return os.path.join(dataset_folder, "audio", chunk)
+
+
+def build_feature_cache(dataset_folder, config=None, workers=None, batch_size=64, save_every=16):
+    """
+    Computes features for every chunk that is new or changed since the last run
+    and appends them to the index's data file (`features/features.f32`), a single float32 array.
+
+    Rows of removed or changed chunks are left in place until `compact_feature_cache`
+    rewrites the file. Changing the config rebuilds the cache from scratch.
+    The index is saved every `save_every` batches, and rows an interrupted run
+    wrote after its last save are cut off before appending again.
+
+    Returns:
+        int: Number of chunks (re)computed.
+    """
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    audio_folder = os.path.join(dataset_folder, "audio")
+    os.makedirs(cache_folder(dataset_folder), exist_ok=True)
+
+    index = load_index(index_path(dataset_folder))
+    data_file = os.path.join(cache_folder(dataset_folder), index["data"] or "features.f32")
+    indexed_bytes = index["rows"] * feature_width(config) * 4
+    if index["config"] != config or not os.path.exists(data_file) or os.path.getsize(data_file) < indexed_bytes:
+        index = {"data": os.path.basename(data_file), "config": config, "rows": 0, "chunks": {}}
+        open(data_file, "wb").close()
+    else:
+        os.truncate(data_file, indexed_bytes)  # Drop unindexed rows of an interrupted run
+
+    # Chunk files plus virtual chunks, which only exist in the manifest
+    chunk_manifest = manifest.load_manifest(manifest.manifest_path(dataset_folder))
+    chunks = {f for f in os.listdir(audio_folder) if f.endswith(".wav")}
+    chunks |= {chunk for chunk, entry in chunk_manifest.items() if virtual_audio.is_virtual(entry)}
+    chunks = sorted(chunks)
+    signatures = {chunk: chunk_signature(dataset_folder, chunk, chunk_manifest.get(chunk)) for chunk in chunks}
+    stale = [chunk for chunk in chunks
+             if not signature_matches(index["chunks"].get(chunk, {}), signatures[chunk])]
+
+    # Drop entries of chunks that no longer exist
+    index["chunks"] = {chunk: entry for chunk, entry in index["chunks"].items() if chunk in signatures}
+    if not stale:
+        save_index(index_path(dataset_folder), index)
+        print("Feature cache is up to date.")
+        return 0
+
+    batches = [stale[i:i + batch_size] for i in range(0, len(stale), batch_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(data_file, "ab") as data:
+        results = executor.map(_compute_batch,
+                               [[_job(dataset_folder, chunk, chunk_manifest.get(chunk)) for chunk in batch]
+                                for batch in batches],
+                               [config] * len(batches))
+        for number, (batch, batch_features) in enumerate(tqdm(zip(batches, results), total=len(batches),
+                                                              desc="Computing Features", unit="batch"), start=1):
+            for chunk, chunk_features in zip(batch, batch_features):
+                data.write(chunk_features.tobytes())
+                index["chunks"][chunk] = {"offset": index["rows"], "frames": len(chunk_features),
+                                          **signatures[chunk]}
+                index["rows"] += len(chunk_features)
+            if number % save_every == 0:
+                data.flush()  # Rows must be on disk before the index points at them
+                save_index(index_path(dataset_folder), index)
+
+    save_index(index_path(dataset_folder), index)
+    logging.info(f"Cached features for {len(stale)} chunks in {data_file}")
+    return len(stale)
+
+
+def compact_feature_cache(dataset_folder):
+    """
+    Rewrites the feature file without rows that no index entry points to.
+    The rows are copied to a second file and the index is switched over to it,
+    so an interrupted compaction leaves the old file and index in use.
+    """
+    path = index_path(dataset_folder)
+    index = load_index(path)
+    if index["data"] is None or index["rows"] == sum(entry["frames"] for entry in index["chunks"].values()):
+        return
+    cache = FeatureCache(dataset_folder)
+    old_file = os.path.join(cache_folder(dataset_folder), index["data"])
+    index["data"] = "features.1.f32" if index["data"] == "features.f32" else "features.f32"
+
+    rows = 0
+    with open(os.path.join(cache_folder(dataset_folder), index["data"]), "wb") as data:
+        for chunk, entry in sorted(index["chunks"].items(), key=lambda item: item[1]["offset"]):
+            data.write(np.ascontiguousarray(cache.get(chunk, check=False)).tobytes())
+            index["chunks"][chunk] = {**entry, "offset": rows}
+            rows += entry["frames"]
+    del cache
+    index["rows"] = rows
+    save_index(path, index)
+    os.remove(old_file)
+
+
+def drop_features(dataset_folder, keep, label=None):
+    """Removes index entries of chunks not in `keep` (e.g. after cleaning)"""
+    path = index_path(dataset_folder, label)
+    if os.path.exists(path):
+        index = load_index(path)
+        index["chunks"] = {chunk: entry for chunk, entry in index["chunks"].items() if chunk in keep}
+        save_index(path, index)
+
+
+def rename_features(dataset_folder, renamed, label=None):
+    """Applies an {old chunk name: new chunk name} mapping to the feature index"""
+    path = index_path(dataset_folder, label)
+    if os.path.exists(path):
+        index = load_index(path)
+        index["chunks"] = {renamed.get(chunk, chunk): entry for chunk, entry in index["chunks"].items()}
+        save_index(path, index)
+
+
+def split_features(dataset_folder, output_folder, chunks, label):
+    """
+    Writes the cached features of a split's chunks to the split folder's own
+    `{label}_features.f32` and `{label}_features.json`, so the split does not
+    depend on the parent's feature file (which cleaning compacts).
+    Only chunks whose cached features are still valid are carried over, signed
+    with the split's own copy of the audio (virtual chunks are materialized there).
+    """
+    index = load_index(index_path(dataset_folder))
+    if not index["chunks"]:
+        return
+    cache = FeatureCache(dataset_folder)
+    data_name = f"{label}_features.f32"
+    data_file = os.path.join(output_folder, data_name)
+
+    split_chunks = {}
+    rows = 0
+    with open(f"{data_file}.tmp", "wb") as data:
+        for chunk in sorted(chunks, key=lambda chunk: index["chunks"].get(chunk, {}).get("offset", 0)):
+            try:
+                chunk_features = cache.get(chunk)
+                if chunk_features is None:
+                    continue
+                signature = file_signature(os.path.join(output_folder, "audio", chunk))
+            except FileNotFoundError:
+                continue
+            data.write(np.ascontiguousarray(chunk_features).tobytes())
+            split_chunks[chunk] = {"offset": rows, "frames": len(chunk_features), **signature}
+            rows += len(chunk_features)
+    del cache
+    os.replace(f"{data_file}.tmp", data_file)
+
+    save_index(index_path(output_folder, label), {
+        "data": data_name,
+        "config": index["config"],
+        "rows": rows,
+        "chunks": split_chunks,
+    })
+
+
+def merge_features(output_folder, origins):
+    """
+    Builds a merged dataset's feature cache from the caches of the datasets it
+    was merged from, given {new chunk name: (dataset folder, old chunk name)}.
+    Entries are checked against the merged copy of the audio, so this also works
+    after the chunks were moved. Caches computed with a different config than
+    the first one are skipped; `build_feature_cache` fills in whatever is missing.
+
+    Returns:
+        int: Number of chunks carried over.
+    """
+    caches = {}
+    for dataset_folder, _ in origins.values():
+        if dataset_folder not in caches:
+            caches[dataset_folder] = FeatureCache(dataset_folder) \
+                if os.path.exists(index_path(dataset_folder)) else None
+    configs = [cache.index["config"] for cache in caches.values() if cache is not None]
+    if not configs:
+        return 0
+
+    chunk_manifest = manifest.load_manifest(manifest.manifest_path(output_folder))
+    os.makedirs(cache_folder(output_folder), exist_ok=True)
+    index = {"data": "features.f32", "config": configs[0], "rows": 0, "chunks": {}}
+    with open(os.path.join(cache_folder(output_folder), index["data"]), "wb") as data:
+        for chunk, (dataset_folder, original) in origins.items():
+            cache = caches[dataset_folder]
+            if cache is None or cache.index["config"] != index["config"] or original not in cache:
+                continue
+            try:
+                signature = chunk_signature(output_folder, chunk, chunk_manifest.get(chunk))
+            except FileNotFoundError:
+                continue
+            # Sources are renumbered by the merge, the range itself is unchanged
+            original_entry = cache.manifest.get(original)
+            expected = {**signature, "source_id": original_entry["source_id"]} \
+                if virtual_audio.is_virtual(original_entry) else signature
+            if not signature_matches(cache.index["chunks"][original], expected):
+                continue
+
+            chunk_features = cache.get(original, check=False)
+            data.write(np.ascontiguousarray(chunk_features).tobytes())
+            index["chunks"][chunk] = {"offset": index["rows"], "frames": len(chunk_features), **signature}
+            index["rows"] += len(chunk_features)
+    del caches
+    save_index(index_path(output_folder), index)
+    return len(index["chunks"])
+
+
+class FeatureCache:
+    """
+    Read access to cached features through a memory-mapped array.
+
+        cache = FeatureCache("Common_dataset")
+        features = cache["12.wav"]   # (frames, n_mels) view, nothing is copied
+    """
+
+    def __init__(self, dataset_folder, label=None):
+        self.dataset_folder = dataset_folder
+        self.manifest = manifest.load_manifest(manifest.manifest_path(dataset_folder, label))
+        self.index = load_index(index_path(dataset_folder, label))
+        if self.index["data"] is None:
+            raise FileNotFoundError(f"No feature cache in {dataset_folder}")
+        data_file = os.path.join(os.path.dirname(index_path(dataset_folder, label)), self.index["data"])
+        width = feature_width(self.index["config"])
+        self.array = np.memmap(data_file, dtype=np.float32, mode="r", shape=(self.index["rows"], width)) \
+            if self.index["rows"] else np.zeros((0, width), dtype=np.float32)
+
+    def __contains__(self, chunk):
+        return chunk in self.index["chunks"]
+
+    def __len__(self):
+        return len(self.index["chunks"])
+
+    def __getitem__(self, chunk):
+        features = self.get(chunk)
+        if features is None:
+            raise KeyError(chunk)
+        return features
+
+    def get(self, chunk, check=True):
+        """
+        Features of a chunk, or None if it is not cached or (with `check`)
+        its audio changed after it was cached.
+        """
+        entry = self.index["chunks"].get(chunk)
+        if entry is None:
+            return None
+        if check:
+            try:
+                signature = chunk_signature(self.dataset_folder, chunk, self.manifest.get(chunk))
+            except FileNotFoundError:
+                return None
+            if not signature_matches(entry, signature):
+                return None
+        return self.array[entry["offset"]:entry["offset"] + entry["frames"]]
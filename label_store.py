@@ -0,0 +1,150 @@
+import os
+import shutil
+import logging
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+SCHEMA = pa.schema([
+    ("chunk_id", pa.int64()),
+    ("transcript", pa.string()),
+    ("duration", pa.float64()),
+    ("source", pa.string()),
+])
+
+
+def store_path(dataset_folder, label=None):
+    """
+    Returns the Parquet label store of a dataset folder.
+
+    The store is a directory of part files, one per ingestion batch, read
+    together as a single pyarrow dataset.
+    """
+    name = f"{label}_labels.parquet" if label else "labels.parquet"
+    return os.path.join(dataset_folder, name)
+
+
+def chunk_id(chunk):
+    """'12.wav' -> 12, None for names that are not plain numbers"""
+    stem = os.path.splitext(chunk)[0]
+    return int(stem) if stem.isdigit() else None
+
+
+def table_from_labels(labels, chunk_manifest=None):
+    """
+    Builds a typed label table from labels.json style {chunk: text} pairs,
+    taking duration and source from the manifest when it has them.
+    """
+    chunk_manifest = chunk_manifest or {}
+    ids, transcripts, durations, sources = [], [], [], []
+    for chunk, text in labels.items():
+        number = chunk_id(chunk)
+        if number is None:
+            logging.warning(f"Skipping chunk without a numeric id: {chunk}")
+            continue
+        entry = chunk_manifest.get(chunk, {})
+        ids.append(number)
+        transcripts.append(text)
+        durations.append(entry.get("duration"))
+        sources.append(entry.get("source"))
+
+    return pa.table([ids, transcripts, durations, sources], schema=SCHEMA).sort_by("chunk_id")
+
+
+def append_batch(dataset_folder, labels, chunk_manifest=None, label=None):
+    """
+    Appends one ingestion batch to the store as a new part file (one row group),
+    leaving the earlier batches untouched.
+    """
+    path = store_path(dataset_folder, label)
+    os.makedirs(path, exist_ok=True)
+    table = table_from_labels(labels, chunk_manifest)
+    if table.num_rows == 0:
+        return
+
+    part = len([f for f in os.listdir(path) if f.endswith(".parquet")])
+    pq.write_table(table, os.path.join(path, f"part-{part:05d}.parquet"), row_group_size=table.num_rows)
+    logging.info(f"Appended {table.num_rows} rows to {path}")
+
+
+def stage_table(dataset_folder, table, label=None):
+    """
+    Writes `table` as a single compacted part file to `labels.parquet.new`,
+    next to the live store, without swapping it in.
+
+    Returns:
+        str: Path of the staged store.
+    """
+    staged_path = f"{store_path(dataset_folder, label)}.new"
+    shutil.rmtree(staged_path, ignore_errors=True)
+    os.makedirs(staged_path)
+    pq.write_table(table.cast(SCHEMA), os.path.join(staged_path, "part-00000.parquet"))
+    return staged_path
+
+
+def swap_in(staged_path, path):
+    """Replaces the store at `path` with the staged one, moving the old store aside first"""
+    old_path = f"{path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(staged_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def write_table(dataset_folder, table, label=None):
+    """
+    Replaces the whole store with `table` as a single compacted part file.
+    The new store is built next to the old one and swapped in.
+    """
+    swap_in(stage_table(dataset_folder, table, label), store_path(dataset_folder, label))
+
+
+def write_labels(dataset_folder, labels, chunk_manifest=None, label=None):
+    """Rewrites the store from labels.json style labels (used after cleaning)."""
+    write_table(dataset_folder, table_from_labels(labels, chunk_manifest), label)
+
+
+def read_labels(dataset_folder, columns=None, filter=None, label=None):
+    """
+    Reads the store, pushing column selection and row filters down to Parquet,
+    e.g. `read_labels(folder, filter=ds.field("duration") > 2.0)`.
+
+    Returns:
+        pyarrow.Table
+    """
+    dataset = ds.dataset(store_path(dataset_folder, label), format="parquet", schema=SCHEMA)
+    return dataset.to_table(columns=columns, filter=filter)
+
+
+def exists(dataset_folder, label=None):
+    """Whether the dataset already has a Parquet label store"""
+    return os.path.isdir(store_path(dataset_folder, label))
+
+
+def split_store(dataset_folder, output_folder, chunks, label):
+    """
+    Writes the rows of the given chunk names to `output_folder`'s
+    `{label}_labels.parquet`, filtering inside the Parquet scan.
+    """
+    ids = [number for number in map(chunk_id, chunks) if number is not None]
+    table = read_labels(dataset_folder, filter=ds.field("chunk_id").isin(ids))
+    write_table(output_folder, table.sort_by("chunk_id"), label)
+
+
+def rename_chunks(dataset_folder, renamed, label=None, labels=None):
+    """
+    Applies an {old chunk name: new chunk name} mapping to the store, keeping
+    chunks that are not in the mapping as they are. With `labels`, rows whose
+    (renamed) chunk has no label are dropped, so the store matches labels.json.
+    """
+    mapping = {chunk_id(old): chunk_id(new) for old, new in renamed.items()}
+    frame = read_labels(dataset_folder, label=label).to_pandas()
+    frame["chunk_id"] = frame["chunk_id"].map(mapping).fillna(frame["chunk_id"]).astype("int64")
+    if labels is not None:
+        frame = frame[frame["chunk_id"].isin([chunk_id(chunk) for chunk in labels])]
+    frame = frame.sort_values("chunk_id")
+    write_table(dataset_folder, pa.Table.from_pandas(frame, schema=SCHEMA, preserve_index=False), label)
+
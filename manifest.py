@@ -0,0 +1,137 @@
+import os
+import json
+import random
+
+
+def manifest_path(dataset_folder, label=None):
+    """
+    Returns the manifest path of a dataset folder.
+
+    Split folders written by `algo.k_fold` prefix their files with the split
+    name (`train_manifest.json`), just like their label files.
+    """
+    name = f"{label}_manifest.json" if label else "manifest.json"
+    return os.path.join(dataset_folder, name)
+
+
+def load_manifest(path):
+    """Load the manifest, or an empty one if the dataset has none yet"""
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    return {}
+
+
+def save_manifest(path, manifest):
+    """Save the manifest atomically"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=4, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def chunk_entry(chunk, source, start_ms=None, end_ms=None):
+    """
+    Describes one chunk produced by `split_audio`.
+
+    Args:
+        chunk (AudioSegment): The chunk audio.
+        source (str): The file or URL the chunk was cut from.
+        start_ms (int): Start of the range a virtual chunk spans in its source.
+        end_ms (int): End of that range.
+
+    Returns:
+        dict: Duration, sample rate and sample count, plus the range (and the
+        byte offset of its first frame in the source PCM) for virtual chunks.
+        Exported chunks join several speech pieces, so no single range of the
+        source matches them and none is recorded.
+    """
+    entry = {
+        "duration": len(chunk) / 1000,
+        "num_samples": int(chunk.frame_count()),
+        "sample_rate": chunk.frame_rate,
+        "source": source,
+    }
+    if start_ms is not None:
+        frame_width = chunk.sample_width * chunk.channels
+        entry.update(byte_offset=int(start_ms * chunk.frame_rate / 1000) * frame_width,
+                     start_ms=start_ms, end_ms=end_ms)
+    return entry
+
+
+def sync_with_labels(manifest, labels):
+    """
+    Drops entries whose chunk has no label and copies each transcript into
+    its entry, so the manifest alone is enough to build a training loader.
+    """
+    return {
+        chunk: {**manifest[chunk], "text": text}
+        for chunk, text in labels.items()
+        if chunk in manifest
+    }
+
+
+def rename_entries(manifest, renamed):
+    """Applies an {old chunk name: new chunk name} mapping to the manifest."""
+    return {renamed.get(chunk, chunk): entry for chunk, entry in manifest.items()}
+
+
+class LengthBucketSampler:
+    """
+    Yields batches of chunk names whose durations are close to each other.
+
+    Chunks are shuffled, cut into windows of `batch_size * window_batches`,
+    sorted by duration inside each window and split into batches; the batch
+    order is then shuffled again. Batches need little padding while still
+    varying between epochs. With `shuffle=False` the whole dataset is sorted
+    by duration instead.
+
+    It only needs `__iter__` and `__len__`, so it can be handed to a PyTorch
+    DataLoader as `batch_sampler`.
+    """
+
+    def __init__(self, manifest, batch_size, shuffle=True, window_batches=100, seed=None):
+        self.durations = {chunk: entry["duration"] for chunk, entry in manifest.items()}
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.window_batches = window_batches
+        self.random = random.Random(seed)
+
+    def __len__(self):
+        return (len(self.durations) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        chunks = list(self.durations)
+        if not self.shuffle:
+            chunks.sort(key=self.durations.get)
+            return iter(self._batches(chunks))
+
+        self.random.shuffle(chunks)
+        window = self.batch_size * self.window_batches
+        batches = []
+        for start in range(0, len(chunks), window):
+            batches.extend(self._batches(sorted(chunks[start:start + window], key=self.durations.get)))
+        self.random.shuffle(batches)
+        return iter(batches)
+
+    def _batches(self, chunks):
+        return [chunks[i:i + self.batch_size] for i in range(0, len(chunks), self.batch_size)]
+
+
+def export_bucketed_order(dataset_folder, batch_size, label=None, shuffle=True, seed=None):
+    """
+    Writes one epoch of length-bucketed batches to `batches.json`
+    (`train_batches.json` for split folders) for loaders that just read a list.
+
+    Returns:
+        str: Path of the written file.
+    """
+    manifest = load_manifest(manifest_path(dataset_folder, label))
+    sampler = LengthBucketSampler(manifest, batch_size, shuffle=shuffle, seed=seed)
+    batches = list(sampler)
+
+    output_file = os.path.join(dataset_folder, f"{label}_batches.json" if label else "batches.json")
+    with open(output_file, "w", encoding="utf-8") as file:
+        json.dump(batches, file, indent=4)
+    print(f" {len(batches)} length-bucketed batches written to {output_file}")
+    return output_file
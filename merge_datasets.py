@@ -0,0 +1,186 @@
+import os
+import shutil
+import hashlib
+from collections import Counter
+from tqdm import tqdm
+import manifest
+import label_store
+import features
+import virtual_audio
+from data_cleaner import load_labels, save_labels, update_labels_csv
+
+
+def file_hash(path, block_size=1 << 20):
+    """Content hash of a chunk, used to find the same audio in several datasets"""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_sort_key(chunk):
+    stem = chunk.split(".")[0]
+    return (0, int(stem), chunk) if stem.isdigit() else (1, 0, chunk)
+
+
+def plan_merge(dataset_folders, dedup=False):
+    """
+    Builds the complete renumbering plan in one pass over the sources.
+
+    Chunks keep their order (dataset by dataset, then by chunk number) and are
+    numbered 1..N without gaps. Only labelled chunks whose audio exists are kept.
+    Virtual chunks stay virtual: the sources they point into are renumbered too.
+    With `dedup`, only chunks sharing their size with another chunk are hashed
+    (files by content, virtual chunks by the PCM of their range).
+
+    Returns:
+        tuple: (plan as a list of (chunk path or None for virtual chunks, new chunk name,
+        text, manifest entry, (dataset folder, old chunk name)), {source path: new source id},
+        number of duplicates skipped)
+    """
+    candidates = []
+    source_plan = {}
+    readers = []
+    for dataset_folder in dataset_folders:
+        audio_folder = os.path.join(dataset_folder, "audio")
+        labels = load_labels(os.path.join(dataset_folder, "labels.json"))
+        chunk_manifest = manifest.load_manifest(manifest.manifest_path(dataset_folder))
+        on_disk = {entry.name: entry for entry in os.scandir(audio_folder) if entry.name.endswith(".wav")}
+        virtual_chunks = {chunk for chunk, entry in chunk_manifest.items()
+                          if virtual_audio.is_virtual(entry) and chunk in labels and chunk not in on_disk}
+        reader = virtual_audio.VirtualChunkReader(dataset_folder) if virtual_chunks else None
+        if reader is not None:
+            readers.append(reader)
+
+        for chunk in sorted((on_disk.keys() & labels.keys()) | virtual_chunks, key=chunk_sort_key):
+            entry = chunk_manifest.get(chunk)
+            if chunk in on_disk:
+                size = ("file", on_disk[chunk].stat().st_size) if dedup else None
+                candidates.append((on_disk[chunk].path, size, labels[chunk], entry, None, (dataset_folder, chunk)))
+                continue
+
+            source_file = virtual_audio.source_path(dataset_folder, entry["source_id"])
+            size = ("virtual", entry["num_samples"]) if dedup else None
+            candidates.append((None, size, labels[chunk], entry, (reader, source_file), (dataset_folder, chunk)))
+
+    shared_sizes = set()
+    if dedup:
+        sizes = Counter(candidate[1] for candidate in candidates)
+        shared_sizes = {size for size, count in sizes.items() if count > 1}
+
+    plan = []
+    seen_hashes = set()
+    duplicates = 0
+    for chunk_path, size, text, entry, virtual, origin in candidates:
+        if size in shared_sizes:
+            if virtual is None:
+                digest = file_hash(chunk_path)
+            else:
+                reader, _ = virtual
+                digest = hashlib.blake2b(reader.read_entry(entry)[0]).hexdigest()
+            if digest in seen_hashes:
+                duplicates += 1
+                continue
+            seen_hashes.add(digest)
+        if virtual is not None:
+            # Sources are numbered only once a chunk pointing into them is kept
+            source_id = source_plan.setdefault(virtual[1], str(len(source_plan) + 1))
+            entry = {**entry, "source_id": source_id}
+        plan.append((chunk_path, f"{len(plan) + 1}.wav", text, entry, origin))
+
+    for reader in readers:
+        reader.close()
+    return plan, source_plan, duplicates
+
+
+def materialize(src, dst, move=False):
+    """Hardlink (or move) a chunk into the merged dataset, copying only across filesystems"""
+    if move:
+        try:
+            os.replace(src, dst)
+        except OSError:
+            shutil.move(src, dst)
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def merge_datasets(dataset_folders, output_folder, move=False, dedup=False):
+    """
+    Merge several `*_dataset` folders into a new, continuously numbered dataset.
+
+    Args:
+        dataset_folders (list): Source dataset folders, in the order to merge them.
+        output_folder (str): New dataset folder (must not contain a dataset yet).
+        move (bool): Move chunks out of the sources instead of hardlinking them.
+        dedup (bool): Skip chunks whose audio is identical to an earlier one.
+
+    Returns:
+        int: Number of chunks in the merged dataset.
+    """
+    audio_folder = os.path.join(output_folder, "audio")
+    if os.path.exists(audio_folder) and os.listdir(audio_folder):
+        print(f"❌ Error: {audio_folder} already contains audio, choose a new output folder.")
+        return 0
+    os.makedirs(audio_folder, exist_ok=True)
+
+    plan, source_plan, duplicates = plan_merge(dataset_folders, dedup)
+
+    if source_plan:
+        os.makedirs(virtual_audio.sources_folder(output_folder), exist_ok=True)
+    for source_file, source_id in source_plan.items():
+        materialize(source_file, virtual_audio.source_path(output_folder, source_id), move)
+
+    labels = {}
+    merged_manifest = {}
+    origins = {}
+    for src, new_name, text, entry, origin in tqdm(plan, desc="Merging Chunks", unit="chunk"):
+        if src is not None:  # Virtual chunks only need their source, linked above
+            materialize(src, os.path.join(audio_folder, new_name), move)
+        labels[new_name] = text
+        origins[new_name] = origin
+        if entry is not None:
+            merged_manifest[new_name] = entry
+
+    # Write every label file once
+    save_labels(os.path.join(output_folder, "labels.json"), labels)
+    update_labels_csv(output_folder, labels)
+    merged_manifest = manifest.sync_with_labels(merged_manifest, labels)
+    if merged_manifest:
+        manifest.save_manifest(manifest.manifest_path(output_folder), merged_manifest)
+    label_store.write_labels(output_folder, labels, merged_manifest)
+
+    # Hardlinked, copied and moved chunks keep their size and mtime, so cached features stay valid
+    carried = features.merge_features(output_folder, origins)
+    if carried:
+        print(f"📈 Carried over cached features of {carried} chunks.")
+
+    print(f"\n✅ Merged {len(plan)} chunks from {len(dataset_folders)} datasets into {output_folder}")
+    if dedup:
+        print(f"🔁 Skipped {duplicates} duplicate chunks.")
+    return len(plan)
+
+
+if __name__ == "__main__":
+    dataset_folders = []
+    print("Enter the dataset folders to merge, one per line (leave empty to finish):")
+    while True:
+        folder = input(f"Dataset {len(dataset_folders) + 1}: ").strip()
+        if not folder:
+            break
+        if not os.path.exists(os.path.join(folder, "audio")):
+            print("Error: audio folder not found, skipping.")
+            continue
+        dataset_folders.append(folder)
+
+    if len(dataset_folders) < 2:
+        print("Need at least two datasets to merge.")
+        exit(1)
+
+    output_folder = input("Enter output folder path (leave blank for Merged_dataset): ").strip() or "Merged_dataset"
+    move = input("Move chunks instead of hardlinking them? (y for yes /n for no): ").strip().lower() == "y"
+    dedup = input("Skip duplicate audio across datasets? (y for yes /n for no): ").strip().lower() == "y"
+    merge_datasets(dataset_folders, output_folder, move, dedup)
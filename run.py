@@ -13,6 +13,11 @@ import yt_dlp
 import pandas as pd
 import unidecode
 from algorithms import algo
+import stt_client
+import manifest
+import label_store
+import features
+import virtual_audio
 
 
 def print_banner():
@@ -135,17 +140,47 @@ def increase_volume(input_path, output_path, gain_db=5):
     logging.info(f"Volume increased audio saved: {output_path}")
     return output_path
 
-def split_audio(audio_path, output_folder, start_index=1, max_duration=5000):
+def speech_ranges(audio, min_silence_len, silence_thresh, keep_silence=100):
+    """
+    Same ranges `silence.split_on_silence` cuts, as (start_ms, end_ms) pairs,
+    so chunk positions in the source audio are not lost.
+    """
+    ranges = [[start - keep_silence, end + keep_silence]
+              for start, end in silence.detect_nonsilent(audio, min_silence_len, silence_thresh)]
+
+    # Silence shorter than keep_silence is split evenly between its neighbours
+    for current, following in zip(ranges, ranges[1:]):
+        if following[0] < current[1]:
+            current[1] = (current[1] + following[0]) // 2
+            following[0] = current[1]
+
+    return [(max(start, 0), min(end, len(audio))) for start, end in ranges]
+
+def split_audio(audio_path, output_folder, start_index=1, max_duration=5000, source=None, source_id=None):
+    """
+    Splits audio on silence into chunks of at most `max_duration` ms.
+
+    With a `source_id` the chunks are virtual: nothing is exported and each
+    chunk is the contiguous range of `audio_path` it spans (silences between
+    its pieces included), recorded in its manifest entry.
+
+    Returns:
+        list: (chunk path, duration in seconds, manifest entry) per chunk.
+    """
     logging.info(f"Splitting audio: {audio_path}")
     audio = AudioSegment.from_wav(audio_path)
-    chunks = silence.split_on_silence(audio,
+    ranges = speech_ranges(audio,
         min_silence_len=50,                  # shorter silence considered
         silence_thresh=audio.dBFS - 16)
 
+    if source_id is not None:
+        return virtual_chunks(audio, ranges, output_folder, start_index, max_duration, source, source_id)
+
     final_chunks = []
     temp_chunk = AudioSegment.silent(duration=0)
 
-    for chunk in chunks:
+    for start, end in ranges:
+        chunk = audio[start:end]
         if len(temp_chunk) + len(chunk) <= max_duration:
             temp_chunk += chunk
         else:
@@ -160,48 +195,68 @@ def split_audio(audio_path, output_folder, start_index=1, max_duration=5000):
     for i, chunk in enumerate(tqdm(final_chunks, desc="Saving Chunks", unit="chunk"), start=start_index):
         chunk_path = os.path.join(output_folder, f"{i}.wav")  # Ensure .wav format
         chunk.export(chunk_path, format="wav")  # Export as .wav
-        chunk_paths.append((chunk_path, len(chunk) / 1000))
+        chunk_paths.append((chunk_path, len(chunk) / 1000, manifest.chunk_entry(chunk, source)))
         logging.info(f"Saved chunk: {chunk_path}")
 
     return chunk_paths
 
-def transcribe_chunk(chunk_path,language_code=None):
-    recognizer = sr.Recognizer()
+def virtual_chunks(audio, ranges, output_folder, start_index, max_duration, source, source_id):
+    """Groups speech ranges into spans of at most `max_duration` ms without exporting them"""
+    spans = []
+    for start, end in ranges:
+        if spans and end - spans[-1][0] <= max_duration:
+            spans[-1][1] = end
+        else:
+            spans.append([start, end])
+
+    chunk_paths = []
+    for i, (start, end) in enumerate(spans, start=start_index):
+        entry = manifest.chunk_entry(audio[start:end], source, start, end)
+        entry.update(source_id=source_id, virtual=True)
+        chunk_paths.append((os.path.join(output_folder, f"{i}.wav"), entry["duration"], entry))
+    logging.info(f"Recorded {len(chunk_paths)} virtual chunks of source {source_id}")
+    return chunk_paths
+
+def transcribe_chunk(chunk_path,language_code=None, reader=None, entry=None):
+    client = stt_client.get_client()  # One keep-alive session per worker thread
     logging.info(f"Transcribing: {chunk_path}")
 
-    with sr.AudioFile(chunk_path) as source:  # Directly use .wav file
-        audio = recognizer.record(source)
-        try:
-            text = recognizer.recognize_google(audio, language=language_code)
-            if language_code != 'en-US':
-                text = unidecode.unidecode(text)
-                logging.info(f"Transcription success: {text}")
-            else:
-                logging.info(f"Transcription success: {text}")
-            return chunk_path, text
-        except sr.UnknownValueError:
-            logging.warning("Speech not recognized")
-            return chunk_path, None
-        except sr.RequestError:
-            logging.error("STT service unreachable")
-            return chunk_path, None
-
-def transcribe_audio(chunks, parallel=False, language_code=None):
+    try:
+        if reader is not None:  # Virtual chunk: send its range of the source, no file involved
+            text = client.recognize_pcm(*reader.read_entry(entry), language=language_code)
+        else:
+            text = client.recognize_file(chunk_path, language=language_code)
+        if language_code != 'en-US':
+            text = unidecode.unidecode(text)
+            logging.info(f"Transcription success: {text}")
+        else:
+            logging.info(f"Transcription success: {text}")
+        return chunk_path, text
+    except sr.UnknownValueError:
+        logging.warning("Speech not recognized")
+        return chunk_path, None
+    except sr.RequestError:
+        logging.error("STT service unreachable")
+        return chunk_path, None
+
+def transcribe_audio(chunks, parallel=False, language_code=None, reader=None):
     labels = {}
 
     if parallel:
         with ThreadPoolExecutor() as executor:
-            results = list(executor.map(lambda x: transcribe_chunk(x[0], language_code), chunks))
+            results = list(executor.map(lambda x: transcribe_chunk(x[0], language_code, reader, x[2]), chunks))
     else:
         results = []
         for chunk in tqdm(chunks, desc="Transcribing Chunks", unit="chunk"):
-            result = transcribe_chunk(chunk[0], language_code)  
+            result = transcribe_chunk(chunk[0], language_code, reader, chunk[2])  
             results.append(result)
 
     for chunk_path, text in results:
         if text:
             chunk_name = os.path.basename(chunk_path)
             labels[chunk_name] = text  # Just store the text directly
+        elif reader is not None:
+            logging.info(f"Dropped untranscribed virtual chunk: {os.path.basename(chunk_path)}")
         else:
             os.remove(chunk_path)
             logging.info(f"Deleted untranscribed chunk: {chunk_path}")
@@ -218,19 +273,9 @@ def csv_labels(label_file, dataset_folder):
     with open(labels_json_path, "r") as f:
         labels = json.load(f)
     
-    # Convert to DataFrame
-    data = []
-    for chunk, text in labels.items():
-        data.append({
-            "Chunk": chunk,
-            "Transcription": text
-        })
-    
-    # Create DataFrame and sort numerically by chunk number
-    df = pd.DataFrame(data)
-    df['ChunkNum'] = df['Chunk'].str.replace('.wav', '').astype(int)
-    df.sort_values(by='ChunkNum', inplace=True)
-    df.drop('ChunkNum', axis=1, inplace=True)
+    # Sort numerically by chunk number and build the DataFrame in one go
+    chunks = sorted(labels, key=lambda chunk: int(chunk.replace('.wav', '')))
+    df = pd.DataFrame({"Chunk": chunks, "Transcription": [labels[chunk] for chunk in chunks]})
     df.to_csv(labels_csv_path, index=False)
     print(" labels.csv file created successfully!")
 
@@ -238,9 +283,10 @@ def csv_labels(label_file, dataset_folder):
 def rename_and_update_labels(dataset_folder):
     """
     Renames all audio files in the dataset folder to continuous numbering,
-    updates the labels.json file accordingly, and regenerates the labels.csv file.
+    updates the labels.json and manifest.json files accordingly, and regenerates the labels.csv file.
     """
     labels_file = os.path.join(dataset_folder, "labels.json")
+    manifest_file = manifest.manifest_path(dataset_folder)
     audio_folder = os.path.join(dataset_folder, "audio")
     labels_csv_path = os.path.join(dataset_folder, "labels.csv")
 
@@ -272,6 +318,7 @@ def rename_and_update_labels(dataset_folder):
 
     # Process new files
     new_labels = {}
+    renamed = {}
     for audio_file in audio_files:
         if audio_file not in existing_labels:
             new_name = f"{next_number}.wav"
@@ -281,6 +328,7 @@ def rename_and_update_labels(dataset_folder):
             old_path = os.path.join(audio_folder, audio_file)
             new_path = os.path.join(audio_folder, new_name)
             os.rename(old_path, new_path)
+            renamed[audio_file] = new_name
             
             # Update labels
             if audio_file in existing_labels:
@@ -295,6 +343,11 @@ def rename_and_update_labels(dataset_folder):
     with open(labels_file, "w") as f:
         json.dump(merged_labels, f, indent=4)
 
+    # Keep the manifest in step with the renamed chunks
+    if renamed and os.path.exists(manifest_file):
+        chunk_manifest = manifest.load_manifest(manifest_file)
+        manifest.save_manifest(manifest_file, manifest.rename_entries(chunk_manifest, renamed))
+
     # Update CSV file
     csv_labels(merged_labels, dataset_folder)
     print(" Audio files renamed, labels.json and labels.csv updated successfully!")
@@ -321,7 +374,7 @@ def safe_move(src, dst):
 if __name__ == "__main__":
     print_banner()
     
-    dataset_type = input("Choose dataset type:-\n1: Common Dataset\n2: Saperated Dataset(Training & Testing)\nOr Leave Empty for Common Dataset\n>> ").strip() or "1"    
+    dataset_type = input("Choose dataset type:-\n1: Common Dataset\n2: Saperated Dataset(Training & Testing)\n3: Length-Bucketed Batch Order\nOr Leave Empty for Common Dataset\n>> ").strip() or "1"    
     if dataset_type == "1":
         dataset_name = "Common"
         dataset_mode = input("Choose mode (1: Create New, 2: Append Existing): ").strip() or "1"
@@ -330,9 +383,11 @@ if __name__ == "__main__":
         os.makedirs(temp_folder, exist_ok=True)            
         if input_mode == "1":
             input_path = input("Enter the path of video/audio file: ").strip() or "1"
+            source = os.path.abspath(input_path)
         elif input_mode == "2":
             url = input("Enter the youtube url: ").strip()      
             input_path = download_audio(url, temp_folder)
+            source = url
         else: 
             print("Invalid input mode. Exiting.")               
                
@@ -411,6 +466,8 @@ if __name__ == "__main__":
         language_code = language_codes[language_choice-1]
         speed_factor = float(input("Enter speed factor (1.0 = normal, <1.0 = slow, >1.0 = fast): ").strip() or "1.0")
         parallel = input("Use parallel processing? (y for yes /n for no): ").strip().lower() == "y"
+        precompute_features = input("Precompute log-mel features for training? (y for yes /n for no): ").strip().lower() == "y"
+        virtual = input("Store chunks as ranges of the source audio instead of separate files? (y for yes /n for no): ").strip().lower() == "y"
         
         if dataset_mode == "1":
             output_path = input("Enter output path (leave blank for current folder): ").strip() or os.getcwd()
@@ -437,7 +494,7 @@ if __name__ == "__main__":
             else:
                 existing_labels = {}
 
-            existing_files = [f for f in os.listdir(audio_folder) if f.endswith(".wav")]
+            existing_files = [f for f in os.listdir(audio_folder) if f.endswith(".wav")] + list(existing_labels)  # Virtual chunks have no file
             start_index = max([int(f.split(".")[0]) for f in existing_files if f.split(".")[0].isdigit()], default=0) + 1
             logging.info(f"Appending to existing dataset at {dataset_folder}")
 
@@ -463,16 +520,36 @@ if __name__ == "__main__":
             enhanced_audio = increase_volume(enhanced_audio, extracted_audio, gain_db)
         adjusted_audio = adjust_speed(enhanced_audio, extracted_audio, speed_factor)    
         try:
-            audio_chunks = split_audio(adjusted_audio, temp_folder, start_index)
-            transcriptions = transcribe_audio(audio_chunks, parallel, language_code)
-            for chunk_path, _ in audio_chunks:
+            reader = None
+            source_id = None
+            if virtual:
+                # Keep the preprocessed audio as the source the chunks point into
+                source_id = virtual_audio.next_source_id(dataset_folder)
+                os.makedirs(virtual_audio.sources_folder(dataset_folder), exist_ok=True)
+                adjusted_audio = shutil.move(adjusted_audio, virtual_audio.source_path(dataset_folder, source_id))
+                reader = virtual_audio.VirtualChunkReader(dataset_folder)
+            audio_chunks = split_audio(adjusted_audio, temp_folder, start_index, source=source, source_id=source_id)
+            transcriptions = transcribe_audio(audio_chunks, parallel, language_code, reader)
+            if reader is not None:
+                reader.close()
+            for chunk_path, _, _ in audio_chunks:
                 if os.path.exists(chunk_path):
                     safe_move(chunk_path, os.path.join(audio_folder, os.path.basename(chunk_path)))
             existing_labels.update(transcriptions)
             with open(labels_file, "w") as f:
                 json.dump(existing_labels, f, indent=4)
-            rename_and_update_labels(dataset_folder)
-            csv_labels(existing_labels, dataset_folder)
+            manifest_file = manifest.manifest_path(dataset_folder)
+            chunk_manifest = manifest.load_manifest(manifest_file)
+            chunk_manifest.update({os.path.basename(chunk_path): entry for chunk_path, _, entry in audio_chunks})
+            manifest.save_manifest(manifest_file, manifest.sync_with_labels(chunk_manifest, existing_labels))
+            rename_and_update_labels(dataset_folder)  # Also regenerates labels.csv
+            # Each ingestion run becomes one row group of the Parquet label store
+            if label_store.exists(dataset_folder):
+                label_store.append_batch(dataset_folder, transcriptions, chunk_manifest)
+            else:
+                label_store.write_labels(dataset_folder, existing_labels, chunk_manifest)
+            if precompute_features:
+                features.build_feature_cache(dataset_folder)
             logging.info(f"Dataset updated successfully in '{dataset_folder}'.")
 
         finally:
@@ -492,6 +569,12 @@ if __name__ == "__main__":
             print("Funtions Under Development Please Wait for Future Updates\nSupport SugarCube to get the fuctions faster")
         else :
             print("Invalid choice. Exiting.")
+
+    elif dataset_type == "3":
+        dataset_folder = input("Enter existing dataset folder path: ").strip()
+        split_name = input("Enter split name (train/test) or Leave Empty for a Common Dataset: ").strip() or None
+        batch_size = int(input("Enter batch size (Or Leave Empty for Default 32): ").strip() or "32")
+        manifest.export_bucketed_order(dataset_folder, batch_size, label=split_name)
             
     else:
         print("Invalid choice. Exiting.")    
\ No newline at end of file
@@ -0,0 +1,166 @@
+import os
+import mmap
+import wave
+import struct
+import threading
+from collections import OrderedDict
+
+import manifest
+from stt_client import pcm_to_int16
+
+
+REGION_BYTES = 1 << 20  # Sources are cached in 1 MiB regions (~32 s of 16 kHz mono audio)
+
+
+def sources_folder(dataset_folder):
+    return os.path.join(dataset_folder, "sources")
+
+
+def source_path(dataset_folder, source_id):
+    """Preprocessed source audio that virtual chunks point into"""
+    return os.path.join(sources_folder(dataset_folder), f"{source_id}.wav")
+
+
+def next_source_id(dataset_folder):
+    folder = sources_folder(dataset_folder)
+    existing = [int(f[:-4]) for f in os.listdir(folder) if f[:-4].isdigit()] if os.path.exists(folder) else []
+    return str(max(existing, default=0) + 1)
+
+
+def is_virtual(entry):
+    """Whether a manifest entry is a range of a source rather than a .wav file"""
+    return bool(entry) and entry.get("virtual", False)
+
+
+def wav_layout(data):
+    """
+    Finds the PCM data of a RIFF/WAVE buffer.
+
+    Returns:
+        tuple: (data offset, data length, sample rate, sample width, channels)
+    """
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("Not a WAV file")
+    position, fmt = 12, None
+    while position + 8 <= len(data):
+        chunk_id, size = struct.unpack_from("<4sI", data, position)
+        if chunk_id == b"fmt ":
+            _, channels, sample_rate, _, _, bits = struct.unpack_from("<HHIIHH", data, position + 8)
+            fmt = (sample_rate, bits // 8, channels)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk before fmt chunk")
+            return (position + 8, min(size, len(data) - position - 8)) + fmt
+        position += 8 + size + (size & 1)
+    raise ValueError("WAV file has no data chunk")
+
+
+class VirtualChunkReader:
+    """
+    Serves the audio of virtual chunks straight from their memory-mapped
+    source files, keeping the most recently read regions in an LRU cache.
+
+        reader = VirtualChunkReader("Common_dataset")
+        samples = reader.read_samples("12.wav")
+        reader.materialize("12.wav", "out/12.wav")
+    """
+
+    def __init__(self, dataset_folder, label=None, cache_regions=64):
+        self.dataset_folder = dataset_folder
+        self.manifest = manifest.load_manifest(manifest.manifest_path(dataset_folder, label))
+        self.cache_regions = cache_regions
+        self.regions = OrderedDict()
+        self.sources = {}
+        self.lock = threading.Lock()  # run.py transcribes from several threads
+
+    def close(self):
+        for source_file, mapped, _ in self.sources.values():
+            mapped.close()
+            source_file.close()
+        self.sources.clear()
+        self.regions.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _source(self, source_id):
+        with self.lock:
+            if source_id not in self.sources:
+                source_file = open(source_path(self.dataset_folder, source_id), "rb")
+                mapped = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.sources[source_id] = (source_file, mapped, wav_layout(mapped))
+            return self.sources[source_id]
+
+    def _region(self, source_id, region):
+        key = (source_id, region)
+        with self.lock:
+            if key in self.regions:
+                self.regions.move_to_end(key)
+                return self.regions[key]
+
+        _, mapped, (data_offset, data_length, *_) = self._source(source_id)
+        start = region * REGION_BYTES
+        data = mapped[data_offset + start:data_offset + min(start + REGION_BYTES, data_length)]
+        with self.lock:
+            self.regions[key] = data
+            if len(self.regions) > self.cache_regions:
+                self.regions.popitem(last=False)
+        return data
+
+    def read_entry(self, entry):
+        """
+        PCM of a manifest entry (the chunk does not have to be in this reader's manifest).
+
+        Returns:
+            tuple: (pcm bytes, sample rate, sample width, channels)
+        """
+        source_id = entry["source_id"]
+        _, _, (_, data_length, sample_rate, sample_width, channels) = self._source(source_id)
+        start = entry["byte_offset"]
+        end = min(start + entry["num_samples"] * sample_width * channels, data_length)
+
+        pieces = []
+        for region in range(start // REGION_BYTES, (end - 1) // REGION_BYTES + 1):
+            data = self._region(source_id, region)
+            region_start = region * REGION_BYTES
+            pieces.append(data[max(start - region_start, 0):end - region_start])
+        return b"".join(pieces), sample_rate, sample_width, channels
+
+    def read_pcm(self, chunk):
+        """PCM of a virtual chunk, see `read_entry`"""
+        return self.read_entry(self.manifest[chunk])
+
+    def read_samples(self, chunk):
+        """Mono int16 samples and sample rate of a virtual chunk"""
+        pcm, sample_rate, sample_width, channels = self.read_pcm(chunk)
+        return pcm_to_int16(pcm, sample_width, channels), sample_rate
+
+    def materialize(self, chunk, output_path):
+        """Writes a virtual chunk out as a regular .wav file"""
+        write_wav(output_path, *self.read_pcm(chunk))
+        return output_path
+
+
+def write_wav(output_path, pcm, sample_rate, sample_width, channels):
+    """Writes raw PCM as a .wav file"""
+    with wave.open(output_path, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+
+
+def read_source_range(source_file, byte_offset, num_samples):
+    """
+    One-off read of a source range as mono int16 samples, for process pool
+    workers that do not keep a reader around.
+    """
+    with open(source_file, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        data_offset, data_length, sample_rate, sample_width, channels = wav_layout(mapped)
+        end = min(byte_offset + num_samples * sample_width * channels, data_length)
+        pcm = mapped[data_offset + byte_offset:data_offset + end]
+    return pcm_to_int16(pcm, sample_width, channels), sample_rate
+